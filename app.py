@@ -1,100 +1,233 @@
 import streamlit as st
 import streamlit.components.v1 as components
+from streamlit_autorefresh import st_autorefresh
+import math
 import time
-import csv
-import os
 from datetime import datetime
+from functools import singledispatch
+from typing import Optional
 import gspread
 import json
+import logging
 
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1D8VM5Na1LBIIoMV86Ie8rg6C4jmRceDozupNVydr73w/edit?usp=sharing"
+PREP_SECONDS = 5
+HANG_SECONDS = 7
+REST_SECONDS = 120
+SET_REST_SECONDS = 180
+# Rest countdowns tick in the browser; the server only re-checks this often
+REST_SYNC_SECONDS = 5
+# Progress-bar percentages, indexed by climbs completed
+SET_PCT = tuple(int(i / 4 * 100) for i in range(5))
+SHEET_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+SHEET_HEADER = ["Date", "Activity", "C1_G", "C1_R", "C2_G", "C2_R", "C3_G", "C3_R", "C4_G", "C4_R", "Total"]
+GRADES = tuple(f"V{i}" for i in range(11))
+
+WAKELOCK_JS = """
+<script>
+let wakeLock = null;
 
+async function requestWakeLock() {
+  try {
+    if ('wakeLock' in navigator) {
+      wakeLock = await navigator.wakeLock.request('screen');
 
-def _get_gs_client() -> gspread.Client:
+      document.addEventListener('visibilitychange', async () => {
+        if (document.visibilityState === 'visible') {
+          try {
+            wakeLock = await navigator.wakeLock.request('screen');
+          } catch (e) {
+            console.error(e);
+          }
+        }
+      });
+    }
+  } catch (err) {
+    console.error(err.name, err.message);
+  }
+}
+
+requestWakeLock();
+</script>
+"""
+
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource
+def _load_gs_config() -> Optional[dict]:
     """
-    Create an authenticated gspread client using Streamlit secrets.
+    Read the Google service account config from Streamlit secrets once.
     Supports either:
     - st.secrets["gcp_sa_json"]: full service account JSON as a string
     - [gcp_service_account] table: keys copied from the JSON
+    Returns None if neither is set, there is no secrets.toml, or the JSON is
+    invalid, which turns Sheets syncing off without breaking the timers.
     """
-    cfg = None
+    try:
+        # Preferred: keep the original JSON exactly as Google gave it
+        if "gcp_sa_json" in st.secrets:
+            return json.loads(st.secrets["gcp_sa_json"])
+        if "gcp_service_account" in st.secrets:
+            return dict(st.secrets["gcp_service_account"])
+    except FileNotFoundError:
+        pass  # No secrets.toml at all
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in gcp_sa_json secret: %s", e)
+    return None
+
+
+_GS_CFG = _load_gs_config()
+
 
-    # Preferred: keep the original JSON exactly as Google gave it
-    if "gcp_sa_json" in st.secrets:
-        cfg = json.loads(st.secrets["gcp_sa_json"])
-    elif "gcp_service_account" in st.secrets:
-        cfg = dict(st.secrets["gcp_service_account"])
-    else:
+@st.cache_resource(ttl=3600)
+def _get_gs_client() -> gspread.Client:
+    """
+    Create an authenticated gspread client from the cached service account config.
+    """
+    if _GS_CFG is None:
         raise RuntimeError(
             "No Google service account config found. "
             "Set either 'gcp_sa_json' or '[gcp_service_account]' in secrets.toml."
         )
 
-    return gspread.service_account_from_dict(cfg)
+    # Append-only: the spreadsheets scope is enough, no Drive access needed
+    return gspread.service_account_from_dict(_GS_CFG, scopes=SHEET_SCOPES)
 
 
-def save_to_sheets(data) -> None:
+def _ensure_header(ws: gspread.Worksheet) -> None:
+    """
+    Write the column header if the sheet is still empty.
+    Only reads the first row, never the whole sheet.
+    """
+    if not ws.row_values(1):
+        ws.append_row(SHEET_HEADER, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+
+
+@st.cache_resource(ttl=3600)
+def _get_ws() -> gspread.Worksheet:
+    """
+    Open the tracker worksheet once and reuse it across reruns and sessions.
+    The header check runs here so it happens once per cached worksheet.
+    After that, each append is a single values.append POST over the client's
+    kept-alive session, with no further metadata lookups.
+    """
+    ws = _get_gs_client().open_by_url(SHEET_URL).sheet1
+    _ensure_header(ws)
+    return ws
+
+
+def _append_row(row: list) -> bool:
+    """
+    Append a single 11-column row to Google Sheets.
+    Returns False without writing anything if syncing is off.
+    """
+    if _GS_CFG is None:
+        return False
+
+    _get_ws().append_row(row, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+    return True
+
+
+@singledispatch
+def save_to_sheets(data) -> bool:
     """
     Appends data to Google Sheets. 
     Handles both the 4x4 List and the Hangboard Dictionary.
+    Returns False if nothing was written, e.g. because syncing is off.
     """
-    client = _get_gs_client()
-    sh = client.open_by_url(SHEET_URL)
-    ws = sh.sheet1
-
-    # Check if we are being sent a List (4x4) or a Dictionary (Hangboard)
-    if isinstance(data, list):
-        row_to_send = data
-    elif isinstance(data, dict):
-        # Convert the old Hangboard dictionary into the new 11-column format
-        # [Date, Activity, C1_G, C1_R, C2_G, C2_R, C3_G, C3_R, C4_G, C4_R, Total]
-        row_to_send = [
-            data.get("date"), 
-            data.get("activity"), 
-            "-", "-", "-", "-", "-", "-", "-", "-", # Placeholders
-            data.get("results")
-        ]
-    else:
-        return # Safety break
+    raise TypeError(f"Cannot save {type(data).__name__} to Google Sheets")
 
-    ws.append_row(row_to_send)
 
-st.title("Climbing Tracker")
+@save_to_sheets.register(list)
+def _save_list(data: list) -> bool:
+    # 4x4 rows are already in the sheet's column order
+    return _append_row(data)
 
-page = st.sidebar.radio("Workout", ["Max Hang Timer", "4x4 Tracker"])
 
-# Try to keep the screen awake while this page is open (supported browsers only)
-components.html(
+@save_to_sheets.register(dict)
+def _save_dict(data: dict) -> bool:
+    # Convert the old Hangboard dictionary into the new 11-column format
+    # [Date, Activity, C1_G, C1_R, C2_G, C2_R, C3_G, C3_R, C4_G, C4_R, Total]
+    return _append_row([
+        data.get("date"), 
+        data.get("activity"), 
+        "-", "-", "-", "-", "-", "-", "-", "-", # Placeholders
+        data.get("results")
+    ])
+
+
+def _flush_rows() -> None:
     """
-<script>
-let wakeLock = null;
+    Send all buffered hangboard rows to Google Sheets in a single request.
+    The buffer and any earlier sync error are only cleared once the append
+    succeeds; both are left untouched while syncing is off.
+    """
+    if _GS_CFG is None or not st.session_state.pending_rows:
+        return
 
-async function requestWakeLock() {
-  try {
-    if ('wakeLock' in navigator) {
-      wakeLock = await navigator.wakeLock.request('screen');
+    _get_ws().append_rows(
+        st.session_state.pending_rows,
+        value_input_option="RAW",
+        insert_data_option="INSERT_ROWS",
+    )
+    st.session_state.pending_rows = []
+    st.session_state.sync_error = None
 
-      document.addEventListener('visibilitychange', async () => {
-        if (document.visibilityState === 'visible') {
-          try {
-            wakeLock = await navigator.wakeLock.request('screen');
-          } catch (e) {
-            console.error(e);
-          }
-        }
-      });
-    }
-  } catch (err) {
-    console.error(err.name, err.message);
-  }
-}
 
-requestWakeLock();
+def _countdown_html(phases) -> str:
+    """
+    Build a countdown that ticks entirely in the browser.
+    `phases` is a list of (label, seconds, final_text[, start]) run back to
+    back, each showing `start` (default `seconds`) down to 0 at one tick per
+    second. Phases of a minute or more are shown as mm:ss.
+    """
+    return f"""
+<div style="font-family: 'Source Sans Pro', sans-serif;">
+  <div id="label" style="font-size: 0.9rem;"></div>
+  <div id="value" style="font-size: 2.25rem;"></div>
+  <progress id="bar" max="100" value="0" style="width: 100%;"></progress>
+</div>
+<script>
+const phases = {json.dumps(phases)};
+const ticks = [];
+function clock(t) {{
+  return String(Math.floor(t / 60)).padStart(2, "0") + ":" + String(t % 60).padStart(2, "0");
+}}
+for (const [label, seconds, finalText, start = seconds] of phases) {{
+  for (let t = start; t >= 0; t--) {{
+    const value = t === 0 ? finalText : seconds >= 60 ? clock(t) : t + "s";
+    ticks.push([label, value, Math.floor((seconds - t) / seconds * 100)]);
+  }}
+}}
+
+let i = 0;
+function tick() {{
+  const [label, value, percent] = ticks[i];
+  document.getElementById("label").innerText = label;
+  document.getElementById("value").innerText = value;
+  document.getElementById("bar").value = percent;
+  if (++i >= ticks.length) clearInterval(timer);
+}}
+const timer = setInterval(tick, 1000);
+tick();
 </script>
-""",
-    height=0,
-    width=0,
-)
+"""
+
+st.title("Climbing Tracker")
+
+page = st.sidebar.radio("Workout", ["Max Hang Timer", "4x4 Tracker"])
+
+# Leaving the hang page abandons any hang in progress, so it is never logged
+if page != "Max Hang Timer":
+    st.session_state.hang_start_time = None
+
+if _GS_CFG is None:
+    st.sidebar.warning("Google Sheets sync is off: no valid service account found in secrets.toml.")
+
+# Try to keep the screen awake while this page is open (supported browsers only)
+# Re-sent each rerun so the iframe stays mounted; identical args are not remounted
+components.html(WAKELOCK_JS, height=0, width=0)
 
 if page == "Max Hang Timer":
     st.header("Max Hang Timer")
@@ -108,60 +241,83 @@ if page == "Max Hang Timer":
         st.session_state.is_resting = False
     if "rest_start_time" not in st.session_state:
         st.session_state.rest_start_time = 0
+    if "pending_rows" not in st.session_state:
+        st.session_state.pending_rows = []
+    if "sync_error" not in st.session_state:
+        st.session_state.sync_error = None
+    if "hang_start_time" not in st.session_state:
+        st.session_state.hang_start_time = None
 
     st.subheader(f"Progress: {st.session_state.current_rep} / {reps}")
 
-    # --- THE START BUTTON & ACTION ---
-    if not st.session_state.is_resting and st.session_state.current_rep < reps:
+    # --- THE START BUTTON ---
+    hanging = st.session_state.hang_start_time is not None
+    if not hanging and not st.session_state.is_resting and st.session_state.current_rep < reps:
         if st.button("🚀 START NEXT HANG", use_container_width=True):
-            current = st.session_state.current_rep + 1
-            placeholder = st.empty()
-            bar = st.progress(0) # Create the progress bar
-            
-            # 1. PREP (5s)
-            for t in range(5, -1, -1):
-                percent = int(((5 - t) / 5) * 100)
-                bar.progress(percent)
-                placeholder.metric(f"PREP (Hang {current})", f"{t}s" if t > 0 else "GO!")
-                time.sleep(1)
-            
-            # 2. HANG (7s)
-            bar.progress(0) # Reset bar for the hang
-            for t in range(7, -1, -1):
-                percent = int(((7 - t) / 7) * 100)
-                bar.progress(percent)
-                placeholder.metric(f"🔥 HANG! 🔥", f"{t}s" if t > 0 else "DONE!")
-                time.sleep(1)
-            
+            st.session_state.hang_start_time = time.time()
+            st.rerun()
+
+    # --- THE HANG IN PROGRESS ---
+    if hanging:
+        current = st.session_state.current_rep + 1
+        phases = [
+            (f"PREP (Hang {current})", PREP_SECONDS, "GO!"),
+            ("🔥 HANG! 🔥", HANG_SECONDS, "DONE!"),
+        ]
+        hang_total = sum(seconds + 1 for _, seconds, _ in phases)
+        remaining = hang_total - (time.time() - st.session_state.hang_start_time)
+
+        if remaining > 0:
+            # 1. PREP + 2. HANG: the browser ticks the countdown and reruns us when it ends
+            components.html(_countdown_html(phases), height=110)
+            st_autorefresh(interval=math.ceil(remaining * 1000), key="hang_tick")
+        else:
+            st.session_state.hang_start_time = None
+
             # 3. LOGGING
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            timestamp = datetime.now().isoformat(sep=" ", timespec="seconds")
             rep_data = [timestamp, "Hangboard Rep", f"Rep {current}", f"{weight}kg", "-", "-", "-", "-", "-", "-", f"Hang {current}/{reps}"]
-            save_to_sheets(rep_data)
+            if _GS_CFG is not None:
+                st.session_state.pending_rows.append(rep_data)
             
             # 4. UPDATE STATE
             st.session_state.current_rep += 1
             st.session_state.is_resting = True
             st.session_state.rest_start_time = time.time()
+
+            # 5. SYNC once the last hang is done
+            if st.session_state.current_rep >= reps:
+                try:
+                    _flush_rows()
+                except Exception as e:
+                    # Kept in state so it survives the rerun into the rest timer
+                    st.session_state.sync_error = f"Failed to save to Google Sheets: {e}"
             st.rerun()
 
+    # --- SYNC STATUS & RETRY ---
+    # Rendered before the rest timer so it stays visible while resting
+    if _GS_CFG is not None and st.session_state.pending_rows:
+        if st.session_state.sync_error:
+            st.error(st.session_state.sync_error)
+        if st.button(f"☁️ Finish & Sync ({len(st.session_state.pending_rows)} hangs)"):
+            try:
+                _flush_rows()
+                st.success("Hangs synced to Google Sheet!")
+            except Exception as e:
+                st.session_state.sync_error = f"Failed to save to Google Sheets: {e}"
+                st.rerun()
+
     # --- THE REST TIMER ---
     if st.session_state.is_resting:
-        placeholder = st.empty()
-        bar = st.progress(0) # Rest progress bar
-        
         elapsed = time.time() - st.session_state.rest_start_time
-        total_rest = 120
-        remaining = int(total_rest - elapsed)
+        remaining = int(REST_SECONDS - elapsed)
 
         if remaining > 0:
-            percent = min(100, int((elapsed / total_rest) * 100))
-            bar.progress(percent)
-            mins, secs = divmod(remaining, 60)
-            placeholder.metric("⏳ RESTING", f"{mins:02d}:{secs:02d}")
-            time.sleep(1)
-            st.rerun()
+            # The browser ticks every second and reruns us every few seconds to resync
+            phases = [("⏳ RESTING", REST_SECONDS, "00:00", remaining)]
+            components.html(_countdown_html(phases), height=110)
+            st_autorefresh(interval=min(REST_SYNC_SECONDS, remaining) * 1000, key="rest_tick")
         else:
-            bar.progress(100)
             st.session_state.is_resting = False
             st.toast("Rest Over! Ready for next hang.", icon="🔔")
             st.rerun()
@@ -169,51 +325,56 @@ if page == "Max Hang Timer":
     if st.button("🔄 Reset Session"):
         st.session_state.current_rep = 0
         st.session_state.is_resting = False
+        st.session_state.hang_start_time = None
         st.rerun()
 
 elif page == "4x4 Tracker":
     st.header("4x4 Tracker")
     st.caption("Four climbs. One set. Build power-endurance.")
 
-    grades = [f"V{i}" for i in range(0, 11)]
-
     if "fourbyfour_sets_logged" not in st.session_state:
         st.session_state.fourbyfour_sets_logged = 0
 
     st.write(f"Sets this session: **{st.session_state.fourbyfour_sets_logged} / 4**")
 
-    cols = st.columns(4)
-    # Lists to hold the data we will send to the sheet
-    climb_data = [] 
-    completed_count = 0
-
-    for idx, col in enumerate(cols, start=1):
-        with col:
-            st.subheader(f"Climb {idx}")
-            grade = st.selectbox("Grade", grades, key=f"4x4_grade_{idx}")
-            done = st.checkbox("Completed", key=f"4x4_done_{idx}")
-            
-            # Store Grade and Result (Sent/Fail) for this specific climb
-            climb_data.append(grade)
-            climb_data.append("Sent" if done else "Fail")
-            if done:
-                completed_count += 1
+    # A form batches all 8 widgets into a single rerun on submit
+    with st.form("set4x4"):
+        cols = st.columns(4)
+        # Grade/result slots for each climb, in sheet column order
+        climb_data = [None] * 8
+        completed_count = 0
+
+        for idx, col in enumerate(cols, start=1):
+            with col:
+                st.subheader(f"Climb {idx}")
+                grade = st.selectbox("Grade", GRADES, key=f"4x4_grade_{idx}")
+                done = st.checkbox("Completed", key=f"4x4_done_{idx}")
+                
+                # Store Grade and Result (Sent/Fail) for this specific climb
+                climb_data[2 * (idx - 1)] = grade
+                climb_data[2 * (idx - 1) + 1] = "Sent" if done else "Fail"
+                if done:
+                    completed_count += 1
+
+        submitted = st.form_submit_button("Log 4x4 Set")
 
     st.write(f"Completed this set: **{completed_count}/4 climbs**")
-    st.progress(int(completed_count / 4 * 100))
+    st.progress(SET_PCT[completed_count])
 
     if "fourbyfour_rest_start" not in st.session_state:
         st.session_state.fourbyfour_rest_start = None
 
-    if st.button("Log 4x4 Set"):
+    if submitted:
         # 1. Create the 11-column Row
         # Format: [Timestamp, Activity, C1_G, C1_R, C2_G, C2_R, C3_G, C3_R, C4_G, C4_R, Total]
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = datetime.now().isoformat(sep=" ", timespec="seconds")
         final_row = [timestamp, "4x4"] + climb_data + [f"{completed_count}/4"]
 
         try:
-            save_to_sheets(final_row)
-            st.success("4x4 set logged to Google Sheet with detailed columns!")
+            if save_to_sheets(final_row):
+                st.success("4x4 set logged to Google Sheet with detailed columns!")
+            else:
+                st.warning("Set counted, but Google Sheets sync is off so it was not saved.")
             st.session_state.fourbyfour_sets_logged += 1
             
             if st.session_state.fourbyfour_sets_logged >= 4:
@@ -228,13 +389,13 @@ elif page == "4x4 Tracker":
     rest_placeholder = st.empty()
     if st.session_state.get("fourbyfour_rest_start"):
         elapsed = int(time.time() - st.session_state.fourbyfour_rest_start)
-        remaining = max(0, 180 - elapsed)
+        remaining = max(0, SET_REST_SECONDS - elapsed)
 
         if remaining > 0:
-            mins, secs = divmod(remaining, 60)
-            rest_placeholder.warning(f"⏳ REST TIMER: {mins:02d}:{secs:02d}")
-            time.sleep(1)
-            st.rerun()
+            phases = [("⏳ REST TIMER", SET_REST_SECONDS, "00:00", remaining)]
+            with rest_placeholder.container():
+                components.html(_countdown_html(phases), height=110)
+            st_autorefresh(interval=min(REST_SYNC_SECONDS, remaining) * 1000, key="fourbyfour_rest_tick")
         else:
             rest_placeholder.error("🔔 GET READY FOR NEXT SET!")
             st.session_state.fourbyfour_rest_start = None